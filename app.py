@@ -1,9 +1,15 @@
 
+import os
 import time
 import uuid
+import shutil
+from io import BytesIO
 import tempfile
 import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from cachetools import TTLCache
 from flask import (
     Flask, request, render_template, send_file, jsonify, abort,
     url_for, after_this_request
@@ -17,110 +23,266 @@ APP_PORT = 8000
 
 app = Flask(__name__)
 app.config["MAX_CONTENT_LENGTH"] = 64 * 1024 * 1024  # 64 MB
+app.config["MAX_FORM_MEMORY_SIZE"] = 512 * 1024  # keep form parts out of RAM
 ALLOWED_EXTENSIONS = {".xlsx"}
-PROCESS_CACHE = {}
 
-# Robust closing tag detector (handles namespaces and whitespace, case-insensitive)
-CLOSE_TAG_RE = re.compile(r'</\s*(?:\w+:)?intercompanymessage\s*>', re.IGNORECASE)
-OPEN_TAG_RE  = re.compile(r'<\s*(?:\w+:)?intercompanymessage\b', re.IGNORECASE)
 
+# CPU-bound XML + openpyxl work runs in worker processes so the request
+# threads stay free (and the GIL is bypassed for parallel uploads).
+EXECUTOR = ProcessPoolExecutor(max_workers=os.cpu_count())
 
-def _is_allowed(filename: str) -> bool:
-    return Path(filename).suffix.lower() in ALLOWED_EXTENSIONS
+class _ProcessCache(TTLCache):
+    """Bounded token -> (future, tmp_dir) cache for pending downloads.
 
+    Entries that expire or get evicted have their temp dir removed, so
+    results never accumulate on disk when /download is never hit.
+    """
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._cleanup(value)
+        return key, value
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for _, value in expired:
+            self._cleanup(value)
+        return expired
+
+    @staticmethod
+    def _cleanup(value):
+        _, tmp_dir = value
+        shutil.rmtree(tmp_dir, ignore_errors=True)
 
-def _extract_messages(raw: str) -> list[str]:
-    # Clean BOM, trim
-    raw = raw.replace("\ufeff", "").strip()
-    # Extract <intercompanyMessage>...</intercompanyMessage> blocks (case-insensitive, optional namespace)
-    pattern = re.compile(
-        r'(<\s*(?:\w+:)?intercompanymessage[\s\S]*?</\s*(?:\w+:)?intercompanymessage\s*>)',
-        re.IGNORECASE
-    )
-    matches = pattern.findall(raw)
-    if not matches:
-        raise ValueError("No <intercompanyMessage> blocks found.")
-    cleaned = []
-    for msg in matches:
-        # Remove optional XML declarations inside the chunk
-        msg = re.sub(r'\s*<\?xml[^\>]*\?>', '', msg, flags=re.IGNORECASE)
-        cleaned.append(msg.strip())
-    return cleaned
 
+PROCESS_CACHE = _ProcessCache(maxsize=256, ttl=1800)
 
-def process_xml_and_populate_xl_sheet(xml_content: str, xl_sheet, current_row: int) -> int:
-    # Tolerant XML parsing
-    parser = etree.XMLParser(recover=True)
-    root = etree.fromstring(xml_content, parser=parser)
+# Single-pass tag scanner (handles namespaces and whitespace, case-insensitive).
+# Group 1 = opening tag, group 2 = closing tag, group 3 = XML declaration.
+TAG_SCAN_RE = re.compile(
+    r'(<\s*(?:\w+:)?intercompanymessage\b)'
+    r'|(</\s*(?:\w+:)?intercompanymessage\s*>)'
+    r'|(<\?xml)',
+    re.IGNORECASE
+)
+
+# Optional XML declarations to strip from inside a chunk (bytes: chunks stay
+# UTF-8 bytes all the way into lxml)
+XML_DECL_RE = re.compile(rb'\s*<\?xml[^\>]*\?>', re.IGNORECASE)
+
+# XPath expressions compiled once at import; per-message evaluation is then
+# a pure C traversal. Relative (.//) so they stay inside one message element.
+# string(...) returns "" when the node is absent.
+XP_LINE_ITEMS = etree.XPath('.//purchaseOrder//lineItems//lineItem')
+XP_PUSB = etree.XPath('string(.//purchaseOrder/@PUSB)')
+XP_PO_NUMBER = etree.XPath('string(.//purchaseOrder/@orderNumber)')
+XP_SOS = etree.XPath('string(.//purchaseOrder//header//SoS)')
+XP_CUSTPROFCODE = etree.XPath('string(.//purchaseOrder//header//customerProfileCode)')
+XP_ITRANSPROUTECODE = etree.XPath('string(.//purchaseOrder//header//internationalTransportationRouteCode)')
+XP_POCREATEDATE = etree.XPath('string(.//purchaseOrder//header//purchaseOrderCreationDate)')
+XP_SHIPTO_LINES = etree.XPath('.//purchaseOrder//header//purchaseOrderDetails//purchaseOrderDetail[@type="shiptoaddress"]/text()')
+XP_ORDER_INSTRUCTION = etree.XPath('.//purchaseOrder//header//specialInstructions//specialInstruction[@type="AH"]/text()')
+
+
+# One-pass XML escape for cell text (C-level translate, no repeated .replace)
+_XML_ESCAPE_TABLE = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+
+# Static parts of the output workbook. The output is a fixed 20-column,
+# string-only sheet, so everything except sheet1.xml can be canned.
+_XLSX_STATIC_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+        ' xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/styles.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+        '<borders count="1"><border/></borders>'
+        '<cellStyleXfs count="1"><xf/></cellStyleXfs>'
+        '<cellXfs count="1"><xf xfId="0"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+
+
+class XlsxStreamWriter:
+    """Streams string rows straight into a minimal xlsx file.
+
+    Cells are written as inlineStr elements into sheet1.xml inside the zip,
+    bypassing openpyxl's per-cell objects entirely. Only suitable for the
+    fixed string-only output sheet produced here.
+    """
+
+    def __init__(self, path: str):
+        self._zip = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+        for name, data in _XLSX_STATIC_PARTS.items():
+            self._zip.writestr(name, data)
+        self._sheet = self._zip.open("xl/worksheets/sheet1.xml", mode="w")
+        self._sheet.write(
+            b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+            b'<sheetData>'
+        )
+
+    def append(self, row: list[str]) -> None:
+        # xml:space keeps Excel from trimming padded values on load
+        cells = "".join(
+            f'<c t="inlineStr"><is><t xml:space="preserve">{v.translate(_XML_ESCAPE_TABLE)}</t></is></c>'
+            for v in row
+        )
+        self._sheet.write(f'<row>{cells}</row>'.encode("utf-8"))
+
+    def close(self) -> None:
+        self._sheet.write(b'</sheetData></worksheet>')
+        self._sheet.close()
+        self._zip.close()
 
-    # Helper: safe single value
-    def x1(path: str, default: str = "") -> str:
-        r = root.xpath(path)
-        return r[0] if r else default
 
-    # Helper: list per line item
-    LINE_ITEMS = root.xpath('//purchaseOrder//lineItems//lineItem')
+def _is_allowed(filename: str) -> bool:
+    return Path(filename).suffix.lower() in ALLOWED_EXTENSIONS
+
+
+def _iter_messages(raw: bytes):
+    """Yield each <intercompanyMessage> element from a chunk, streaming.
+
+    The chunk is wrapped in a synthetic root and fed through iterparse, so
+    tree memory stays bounded per message: each yielded element is cleared
+    (and its already-processed siblings dropped) before the next one is
+    parsed. Raises ValueError if the chunk contains no messages.
+    """
+    # Clean leading BOM (O(1) prefix check, no full-buffer replace), trim
+    if raw.startswith(b"\xef\xbb\xbf"):
+        raw = raw[3:]
+    raw = raw.strip()
+    wrapped = b'<r>' + XML_DECL_RE.sub(b'', raw) + b'</r>'
+    found = False
+    for _, elem in etree.iterparse(
+        BytesIO(wrapped), events=('end',),
+        recover=True, collect_ids=False, remove_blank_text=True,
+        huge_tree=False, resolve_entities=False,
+    ):
+        if not isinstance(elem.tag, str):
+            continue  # comments / processing instructions
+        # Tolerant localname: the recover parser keeps literal prefix:tag
+        # names when the prefix is undeclared, which QName would reject.
+        localname = elem.tag.rsplit('}', 1)[-1].rsplit(':', 1)[-1]
+        if localname.lower() != 'intercompanymessage':
+            continue
+        found = True
+        yield elem
+        # Free the processed subtree before parsing continues.
+        elem.clear(keep_tail=False)
+        parent = elem.getparent()
+        while elem.getprevious() is not None:
+            del parent[0]
+    if not found:
+        raise ValueError("No <intercompanyMessage> blocks found.")
 
-    def get_data(locator: str) -> list[str]:
-        return [" ".join(li.xpath(locator)) for li in LINE_ITEMS]
+
+def parse_message_to_rows(root) -> list[list[str]]:
+    """Turn one parsed <intercompanyMessage> element into output rows."""
+    LINE_ITEMS = XP_LINE_ITEMS(root)
 
     # Header/scalar fields (safe)
-    PUSB = x1('//purchaseOrder/@PUSB')
-    PO_NUMBER = x1('//purchaseOrder/@orderNumber')
-    SOS = x1('//purchaseOrder//header//SoS/text()')
-    CUSTPROFCODE = x1('//purchaseOrder//header//customerProfileCode/text()')
+    PUSB = XP_PUSB(root)
+    PO_NUMBER = XP_PO_NUMBER(root)
+    SOS = XP_SOS(root)
+    CUSTPROFCODE = XP_CUSTPROFCODE(root)
     if CUSTPROFCODE != "":
         CUSTPROFCODE = " ".join(["STC", CUSTPROFCODE])
 
-    ITRANSPROUTECODE = x1('//purchaseOrder//header//internationalTransportationRouteCode/text()')
+    ITRANSPROUTECODE = XP_ITRANSPROUTECODE(root)
 
     # Dates (safe parsing)
     from datetime import datetime
-    po_create_raw = x1('//purchaseOrder//header//purchaseOrderCreationDate/text()')
+    po_create_raw = XP_POCREATEDATE(root)
     try:
         POCREATEDATE = datetime.strptime(po_create_raw, "%Y-%m-%d").strftime("%d.%m.%Y") if po_create_raw else ""
     except Exception:
         POCREATEDATE = ""
 
-    # Line-level fields
-    seqs_raw = get_data('./@sequenceNumber')
-    POLINESEQNRS = []
-    for i in seqs_raw:
-        i = (i or "").strip()
-        if i.isdigit():
-            POLINESEQNRS.append(str(int(i)))
-        else:
-            POLINESEQNRS.append(i)
-
-    MMMPRODID = get_data('./productIdentifier/text()')
-    ORDERQTY = get_data('./orderQuantity/text()')
-    SELLINGUNIT = get_data('./sellingUnit/text()')
-    SUPPLY_CHAIN_UNIT = SELLINGUNIT
-
-    PRODUCT_DESCRIPTION = get_data('./lineItemDetails/lineItemDetail[@type="purchaseritemdescription"]/text()')
-    SPECIAL_HANDLING = get_data('./lineItemDetails/lineItemDetail[@type="specialhandlingcode"]/text()')
-
-    no_line_items = len(POLINESEQNRS)
+    # Line-level fields: one walk over each lineItem's children instead of
+    # a separate XPath descent per field, filling pre-sized parallel lists.
+    no_line_items = len(LINE_ITEMS)
+    POLINESEQNRS = [""] * no_line_items
+    MMMPRODID = [""] * no_line_items
+    ORDERQTY = [""] * no_line_items
+    SELLINGUNIT = [""] * no_line_items
+    PRODUCT_DESCRIPTION = [""] * no_line_items
+    SPECIAL_HANDLING = [""] * no_line_items
+    EXPC_SHIP_TYPE_CODE = [""] * no_line_items
+    ship_dates_raw = [""] * no_line_items
+    sap_po_raw = [""] * no_line_items
+
+    for idx, li in enumerate(LINE_ITEMS):
+        seq = (li.get("sequenceNumber") or "").strip()
+        POLINESEQNRS[idx] = str(int(seq)) if seq.isdigit() else seq
+
+        MMMPRODID[idx] = li.findtext("productIdentifier", "")
+        ORDERQTY[idx] = li.findtext("orderQuantity", "")
+        SELLINGUNIT[idx] = li.findtext("sellingUnit", "")
+
+        desc = handling = ""
+        details = li.find("lineItemDetails")
+        if details is not None:
+            for el in details:
+                detail_type = el.get("type")
+                if detail_type == "purchaseritemdescription" and desc == "":
+                    desc = el.text or ""
+                elif detail_type == "specialhandlingcode" and handling == "":
+                    handling = el.text or ""
+        PRODUCT_DESCRIPTION[idx] = desc
+        SPECIAL_HANDLING[idx] = handling
+
+        el = li.find("requestedShipmentDate")
+        if el is not None:
+            EXPC_SHIP_TYPE_CODE[idx] = el.get("type") or ""
+            ship_dates_raw[idx] = el.text or ""
+
+        sap_po_raw[idx] = li.findtext("purchasingCompanyReferenceNumber", "")
     LINE_INSTRUCTION = [""] * no_line_items
 
-    ADDRESS = "; ".join(
-        root.xpath('//purchaseOrder//header//purchaseOrderDetails//purchaseOrderDetail[@type="shiptoaddress"]/text()')[::-1]
-    )
+    ADDRESS = "; ".join(XP_SHIPTO_LINES(root)[::-1])
 
     EXPORT_MARKS = [""] * no_line_items
 
-    ORDER_INSTRUCTION = "".join(
-        root.xpath('//purchaseOrder//header//specialInstructions//specialInstruction[@type="AH"]/text()')
-    )
+    ORDER_INSTRUCTION = "".join(XP_ORDER_INSTRUCTION(root))
     if ORDER_INSTRUCTION != "":
         ORDER_INSTRUCTION = "C" + ORDER_INSTRUCTION
     else:
         ORDER_INSTRUCTION = "null"
 
-    EXPC_SHIP_TYPE_CODE = get_data('./requestedShipmentDate/@type')
-
     EXPC_SHIP_DATE = []
-    for date in get_data('./requestedShipmentDate/text()'):
+    for date in ship_dates_raw:
         try:
             if str(date).strip() not in [None, "None", ""]:
                 EXPC_SHIP_DATE.append(datetime.strptime(date, "%Y-%m-%d").strftime("%d.%m.%Y"))
@@ -129,45 +291,46 @@ def process_xml_and_populate_xl_sheet(xml_content: str, xl_sheet, current_row: i
         except Exception:
             EXPC_SHIP_DATE.append("")
 
-    SAP_PO_NUMBER = get_data('./purchasingCompanyReferenceNumber/text()')
-    SAP_PO_NUMBER = ["null" if (po_number or "") == "" else po_number for po_number in SAP_PO_NUMBER]
+    SAP_PO_NUMBER = ["null" if (po_number or "") == "" else po_number for po_number in sap_po_raw]
 
     # Pack all columns in order
     data = [
         PUSB, PO_NUMBER, SOS, CUSTPROFCODE, ITRANSPROUTECODE, POCREATEDATE,
-        POLINESEQNRS, MMMPRODID, ORDERQTY, SELLINGUNIT, SUPPLY_CHAIN_UNIT,
+        POLINESEQNRS, MMMPRODID, ORDERQTY, SELLINGUNIT, SELLINGUNIT,
         PRODUCT_DESCRIPTION, SPECIAL_HANDLING, LINE_INSTRUCTION, ADDRESS,
         EXPORT_MARKS, ORDER_INSTRUCTION, EXPC_SHIP_TYPE_CODE, EXPC_SHIP_DATE,
         SAP_PO_NUMBER
     ]
 
-    # Write one row per line item
-    for cur_record_num in range(no_line_items):
-        for col in range(len(data)):
-            cur_val = data[col]
-            if isinstance(cur_val, list):
-                # Per-line-item column
-                v = cur_val[cur_record_num] if cur_record_num < len(cur_val) else ""
-                xl_sheet.cell(row=current_row, column=col + 1).value = str(v)
-            else:
-                # Scalar column (same for all line items)
-                xl_sheet.cell(row=current_row, column=col + 1).value = str(cur_val)
-        # Advance row ONCE per record
-        current_row += 1
+    # Classify columns once (per-line-item list vs. scalar) so the row build
+    # below is pure indexing with no isinstance check per cell.
+    kinds = [(isinstance(v, list), v) for v in data]
+
+    # Build one row per line item. Every value is already a str (XPath
+    # string(), findtext and strftime all return str), so no conversion.
+    rows = [
+        [
+            (v[r] if r < len(v) else "") if is_list else v
+            for is_list, v in kinds
+        ]
+        for r in range(no_line_items)
+    ]
 
-    return current_row
+    return rows
 
 
 def process_excel(xl_data_file: str, xl_output_file: str) -> str:
     MAX_PARTS = 1000
     MAX_XML_BYTES = 8 * 1024 * 1024
 
-    wb_in = openpyxl.load_workbook(xl_data_file, read_only=True, data_only=True)
+    wb_in = openpyxl.load_workbook(xl_data_file, read_only=True, data_only=True, keep_links=False)
     ws_in = wb_in.active
-    colA = ["" if r[0] is None else str(r[0]) for r in ws_in.iter_rows(min_row=1, max_col=1, max_row=ws_in.max_row, values_only=True)]
 
-    wb_out = openpyxl.Workbook()
-    ws_out = wb_out.active
+    def iter_cells(ws):
+        for r in ws.iter_rows(min_col=1, max_col=1, values_only=True):
+            yield "" if r[0] is None else str(r[0])
+
+    ws_out = XlsxStreamWriter(xl_output_file)
 
     headers = [
         "PUSB", "PO_NUMBER", "SOS", "CUSTPROFCODE", "ITRANSPROUTECODE", "POCREATEDATE",
@@ -176,79 +339,66 @@ def process_excel(xl_data_file: str, xl_output_file: str) -> str:
         "EXPORT MARKS", "ORDER INSTRUCTION", "EXPC SHIP TYPE CODE", "EXPC SHIP DATE",
         "SAP PO NUMBER"
     ]
-
-    current_row = 1
-    for col, val in enumerate(headers, start=1):
-        ws_out.cell(row=current_row, column=col).value = val
-    current_row += 1
-
-    n = len(colA)
-    i = 0
-    while i < n:
-        cell = colA[i] or ""
-        has_open = OPEN_TAG_RE.search(cell) is not None
-        has_close = CLOSE_TAG_RE.search(cell) is not None
-
-        if has_open or ("<?xml" in cell):
+    ws_out.append(headers)
+
+    def flush_chunk(raw_xml: str, start_row: int) -> None:
+        # Encode once: the size check, extraction and lxml parse all share
+        # the same UTF-8 buffer.
+        raw_bytes = raw_xml.encode("utf-8")
+        if len(raw_bytes) > MAX_XML_BYTES:
+            app.logger.warning(f"Chunk starting at row {start_row} exceeds size limit. Skipping...")
+            return
+        try:
+            for elem in _iter_messages(raw_bytes):
+                for row in parse_message_to_rows(elem):
+                    ws_out.append(row)
+        except Exception as e:
+            app.logger.warning(f"Message extraction failed at row {start_row}: {e}")
+
+    # Streaming state machine: collect cells only while inside a message so
+    # memory stays bounded by one chunk instead of the whole sheet.
+    state = "idle"
+    parts = []
+    start_row = 0
+    for row_num, cell in enumerate(iter_cells(ws_in), start=1):
+        if state == "idle":
+            # Fast path: most rows are plain text — a single C-level char
+            # scan rejects them before any regex work.
+            if "<" not in cell:
+                continue
+            has_open = has_close = has_decl = False
+            for m in TAG_SCAN_RE.finditer(cell):
+                if m.lastindex == 1:
+                    has_open = True
+                elif m.lastindex == 2:
+                    has_close = True
+                else:
+                    has_decl = True
+            if not has_open and not has_decl:
+                continue
             # --- Fast path: the entire message is within the SAME cell ---
             if has_open and has_close:
-                raw_xml = cell
-                if len(raw_xml.encode("utf-8")) > MAX_XML_BYTES:
-                    app.logger.warning(f"Single-cell chunk at row {i+1} exceeds size limit. Skipping...")
-                    i += 1
-                    continue
-                try:
-                    messages = _extract_messages(raw_xml)
-                except Exception as e:
-                    app.logger.warning(f"Message extraction failed at row {i+1}: {e}")
-                    i += 1
-                    continue
-                for msg in messages:
-                    current_row = process_xml_and_populate_xl_sheet(msg, ws_out, current_row)
-                i += 1
+                flush_chunk(cell, row_num)
                 continue
-
-            # --- Multi-row path: scan forward to find the closing tag on subsequent rows ---
+            state = "collect"
             parts = [cell]
-            j = i + 1
-            while j < n and not CLOSE_TAG_RE.search(colA[j] or ""):
-                parts.append(colA[j] or "")
-                if len(parts) > MAX_PARTS:
-                    app.logger.warning(f"Chunk starting at row {i+1} too large. Skipping...")
-                    break
-                j += 1
-
-            if j >= n:
-                app.logger.warning(f"Incomplete XML chunk starting at row {i+1}. Skipping...")
-                i += 1
-                continue
-
-            # Include the closing tag line
-            parts.append(colA[j] or "")
-            raw_xml = "".join(parts)
-
-            if len(raw_xml.encode("utf-8")) > MAX_XML_BYTES:
-                app.logger.warning(f"Chunk starting at row {i+1} exceeds size limit. Skipping...")
-                i = j + 1
-                continue
-
-            try:
-                messages = _extract_messages(raw_xml)
-            except Exception as e:
-                app.logger.warning(f"Message extraction failed at row {i+1}: {e}")
-                i = j + 1
-                continue
-
-            for msg in messages:
-                current_row = process_xml_and_populate_xl_sheet(msg, ws_out, current_row)
-
-            i = j + 1
+            start_row = row_num
         else:
-            i += 1
+            parts.append(cell)
+            if any(m.lastindex == 2 for m in TAG_SCAN_RE.finditer(cell)):
+                flush_chunk("".join(parts), start_row)
+                state = "idle"
+                parts = []
+            elif len(parts) > MAX_PARTS:
+                app.logger.warning(f"Chunk starting at row {start_row} too large. Skipping...")
+                state = "idle"
+                parts = []
+
+    if state == "collect":
+        app.logger.warning(f"Incomplete XML chunk starting at row {start_row}. Skipping...")
 
     wb_in.close()
-    wb_out.save(xl_output_file)
-    wb_out.close()
+    ws_out.close()
 
     return xl_output_file
 
@@ -279,35 +429,56 @@ def process_route():
     output_path = tmp_dir / f"processed_{orig_name}"
 
     try:
-        f.save(str(input_path))
+        # Stream to disk in 1 MB chunks instead of buffering the upload.
+        with open(input_path, "wb") as out:
+            shutil.copyfileobj(f.stream, out, length=1024 * 1024)
     except Exception as e:
         return jsonify({"ok": False, "error": f"Save error: {e}"}), 500
 
     t1 = time.perf_counter()
     app.logger.info(f"Upload saved in {t1 - t0:.2f}s")
 
-    try:
-        final_output = process_excel(str(input_path), str(output_path))
-    except Exception as e:
-        app.logger.exception("Processing error")
-        return jsonify({"ok": False, "error": str(e)}), 500
+    # Hand off to a worker process and return immediately; the client polls
+    # /status until the job is done.
+    fut = EXECUTOR.submit(process_excel, str(input_path), str(output_path))
 
     token = uuid.uuid4().hex
-    PROCESS_CACHE[token] = (final_output, tmp_dir)
+    PROCESS_CACHE[token] = (fut, tmp_dir)
 
     resp = {
         "ok": True,
+        "status_url": url_for("status", token=token, _external=True),
         "download_url": url_for("download", token=token, _external=True),
-        "filename": Path(final_output).name
+        "filename": output_path.name
     }
-    return jsonify(resp), 200
+    return jsonify(resp), 202
+
+
+@app.get("/status/<token>")
+def status(token: str):
+    if token not in PROCESS_CACHE:
+        abort(404, description="Invalid or expired token")
+    fut, _ = PROCESS_CACHE[token]
+    if not fut.done():
+        return jsonify({"ok": True, "done": False}), 200
+    exc = fut.exception()
+    if exc is not None:
+        return jsonify({"ok": False, "done": True, "error": str(exc)}), 200
+    return jsonify({"ok": True, "done": True}), 200
 
 
 @app.get("/download/<token>")
 def download(token: str):
     if token not in PROCESS_CACHE:
         abort(404, description="Invalid or expired token")
-    output_path, tmp_dir = PROCESS_CACHE.pop(token)
+    fut, tmp_dir = PROCESS_CACHE.pop(token)
+
+    try:
+        output_path = fut.result()
+    except Exception as e:
+        app.logger.exception("Processing error")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return jsonify({"ok": False, "error": str(e)}), 500
 
     @after_this_request
     def _cleanup(response):